@@ -1,10 +1,14 @@
 import streamlit as st
-import yfinance as yf
-import plotly.graph_objects as go
+import requests
+import logging
 import math
-import time
+from collections import namedtuple
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 # ========================= DEFAULTS =========================
 DEFAULT_CARRIERS = 2
 DEFAULT_US_MILITARY = "Extreme"
@@ -29,54 +33,83 @@ ASSETS = {
 
 TIMEFRAME_WEIGHTS = {"1h": 0.10, "4h": 0.30, "1d": 0.40, "1wk": 0.20}
 
+# ========================= GEO SCORES =========================
+MILITARY_MAP = {"Low": 0, "Moderate": 15, "High": 25, "Extreme": 32, "Unprecedented": 40}
+IDF_MAP = {"Low": 0, "Moderate": 8, "High": 15}
+
+# asset weight x timeframe weight, shape (len(ASSETS), len(TIMEFRAME_WEIGHTS))
+_TF_W = np.array(list(TIMEFRAME_WEIGHTS.values()))
+_ASSET_W = np.array([info["weight"] for info in ASSETS.values()])
+_COMBINED = _ASSET_W[:, None] * _TF_W[None, :]
+
 # ====================== ROBUST CLOUD-FRIENDLY DATA FETCH ======================
-@st.cache_data(ttl=120, show_spinner=False)
-def get_all_asset_data(ticker):
-    data = {}
-    current_price = 0.0
-    for tf in TIMEFRAME_WEIGHTS:
+# timeframe -> (period, interval, start_idx)
+TF_PARAMS = {
+    "1h": ("1d", "5m", -12),
+    "4h": ("5d", "15m", -16),
+    "1d": ("5d", "1h", -24),
+    "1wk": ("1mo", "1d", -5),
+}
+
+SPARK_URL = "https://query1.finance.yahoo.com/v8/finance/spark"
+
+# Shared connection pool for every spark request; cache_resource keeps it alive across reruns
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.headers.update({"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+                                          "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"})
+    return session
+
+def fetch_timeframe(session, tf):
+    period, interval, start_idx = TF_PARAMS[tf]
+    # One request for every ticker; the response is keyed by symbol
+    resp = session.get(SPARK_URL, params={"symbols": ",".join(ASSETS), "range": period, "interval": interval},
+                       timeout=10)
+    resp.raise_for_status()
+    payload = resp.json()
+    changes, prices = {}, {}
+    for ticker in ASSETS:
         try:
-            # Use Ticker.history — more reliable on cloud
-            if tf == "1h":
-                df = yf.Ticker(ticker).history(period="1d", interval="5m")
-                start_idx = -12
-            elif tf == "4h":
-                df = yf.Ticker(ticker).history(period="5d", interval="15m")
-                start_idx = -16
-            elif tf == "1d":
-                df = yf.Ticker(ticker).history(period="5d", interval="1h")
-                start_idx = -24
-            else:  # 1wk
-                df = yf.Ticker(ticker).history(period="1mo", interval="1d")
-                start_idx = -5
-
-            if len(df) >= 5:
-                start_p = df['Close'].iloc[start_idx]
-                end_p   = df['Close'].iloc[-1]
-                change = ((end_p - start_p) / start_p) * 100.0
-            else:
-                change = 0.0
-
-            data[tf] = change
-            if current_price == 0.0:
-                current_price = float(end_p)
-
-            time.sleep(0.3)  # tiny delay to avoid Yahoo rate-limiting on cloud
-
-        except Exception as e:
-            data[tf] = 0.0
-
-    return data, current_price
+            # Missing bars come back as null -> NaN
+            closes = np.asarray(payload[ticker]["close"], dtype=np.float64)
+            closes = closes[~np.isnan(closes)]
+            if closes.size >= 5:
+                changes[ticker] = float((closes[-1] / closes[start_idx] - 1.0) * 100.0)
+                prices[ticker] = float(closes[-1])
+        except (KeyError, TypeError, IndexError, ValueError) as e:
+            logger.warning("No %s closes for %s: %r", tf, ticker, e)
+    return changes, prices
+
+CACHE_TTL = 120
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_all_market_data():
+    session = get_session()
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(TF_PARAMS)) as ex:
+        futures = {ex.submit(fetch_timeframe, session, tf): tf for tf in TF_PARAMS}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (requests.RequestException, ValueError) as e:
+                logger.warning("Spark request for %s failed: %r", futures[future], e)
+                results[futures[future]] = ({}, {})
+
+    all_data = {}
+    for ticker, info in ASSETS.items():
+        # Stored changes are already signed by direction, so consumers use them as-is
+        data = {tf: results[tf][0].get(ticker, 0.0) * info["direction"] for tf in TIMEFRAME_WEIGHTS}
+        # First timeframe (in TIMEFRAME_WEIGHTS order) that returned a price wins
+        price = next((results[tf][1][ticker] for tf in TIMEFRAME_WEIGHTS if ticker in results[tf][1]), 0.0)
+        all_data[ticker] = {"data": data, "price": price}
+    return all_data
 
 # ====================== CALCULATIONS ======================
 def calculate_market_raw(all_data):
-    total = 0.0
-    for ticker, info in ASSETS.items():
-        asset_data = all_data.get(ticker, {}).get("data", {})
-        weighted = sum(asset_data.get(tf, 0.0) * info["direction"] * TIMEFRAME_WEIGHTS[tf]
-                       for tf in TIMEFRAME_WEIGHTS)
-        total += weighted * info["weight"]
-    return total
+    changes = np.array([[all_data.get(t, {}).get("data", {}).get(tf, 0.0) for tf in TIMEFRAME_WEIGHTS]
+                        for t in ASSETS])
+    return float((changes * _COMBINED).sum())
 
 def normalize_market(raw):
     if raw >= 0:
@@ -85,14 +118,15 @@ def normalize_market(raw):
         decay = (math.log1p(abs(raw) * 2) / math.log1p(20)) * 25
         return max(0, 25 - decay)
 
+GeoScore = namedtuple("GeoScore", "carrier military idf sentiment total")
+
 def calculate_geo_score(carriers, us_military, idf_alert, sentiment):
     carrier_score = min(carriers, 4) * 8.75
-    military_map = {"Low": 0, "Moderate": 15, "High": 25, "Extreme": 32, "Unprecedented": 40}
-    military_score = military_map.get(us_military, 25)
-    idf_map = {"Low": 0, "Moderate": 8, "High": 15}
-    idf_score = idf_map.get(idf_alert, 8)
+    military_score = MILITARY_MAP.get(us_military, 25)
+    idf_score = IDF_MAP.get(idf_alert, 8)
     sentiment_score = (sentiment / 10) * 10
-    return carrier_score + military_score + idf_score + sentiment_score
+    return GeoScore(carrier_score, military_score, idf_score, sentiment_score,
+                    carrier_score + military_score + idf_score + sentiment_score)
 
 def get_progress_color(value, max_val):
     norm = value / max_val
@@ -101,6 +135,57 @@ def get_progress_color(value, max_val):
     elif norm < 0.85: return "#fb923c"
     else: return "#ef4444"
 
+# ====================== GAUGE ======================
+@st.cache_resource(max_entries=256)
+def build_gauge(value_bucket, color):
+    # Cached figures are shared across reruns, so never mutate the returned object
+    import plotly.graph_objects as go  # deferred: only needed on a gauge cache miss
+
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value_bucket,
+        title={"text": "Tension Index", "font": {"size": 28, "color": "white"}},
+        number={"font": {"size": 72, "color": "white"}},
+        gauge={
+            "axis": {"range": [0, 100], "tickwidth": 2, "tickcolor": "white"},
+            "bar": {"color": color, "thickness": 0.32},
+            "bgcolor": "rgba(0,0,0,0)",
+            "borderwidth": 3,
+            "bordercolor": "rgba(255,255,255,0.5)",
+            "steps": [
+                {"range": [0, 30],  "color": "rgba(16,185,129,0.55)"},
+                {"range": [30, 60], "color": "rgba(250,204,21,0.55)"},
+                {"range": [60, 80], "color": "rgba(249,115,22,0.55)"},
+                {"range": [80, 100],"color": "rgba(239,68,68,0.65)"}
+            ],
+            "threshold": {"line": {"color": "white", "width": 7}, "thickness": 1.0, "value": value_bucket}
+        }
+    ))
+
+    fig.update_layout(height=400, paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=40, b=40))
+    return fig
+
+# ====================== CARD TEMPLATES ======================
+ASSET_CARD_TMPL = """
+        <div class="asset-card" title="{tooltip}">
+            <div style="font-size:4.5rem;margin-bottom:10px;">{emoji}</div>
+            <div style="color:{color};font-weight:bold;font-size:1.35rem;">{name}</div>
+            <div style="font-size:1.7rem;color:#e2e8f0;margin:10px 0;">${price:,.2f}</div>
+            <div style="color:{chg_color};font-size:1.6rem;font-weight:bold;">
+                {arrow} {abs_chg:.2f}%
+            </div>
+        </div>
+        """
+
+GEO_CARD_TMPL = """
+        <div class="geo-card" title="Contribution to overall tension index">
+            <div style="font-weight:bold;color:{title_color};font-size:1.25rem;">{title}</div>
+            <div style="font-size:1.6rem;color:white;margin:8px 0;">{value}</div>
+            <div style="color:{color};font-size:1.35rem;font-weight:bold;">+{score:.1f}</div>
+            <div style="height:12px;background:{color};border-radius:6px;margin-top:10px;width:{width}%"></div>
+        </div>
+        """
+
 # ====================== UI ======================
 st.set_page_config(page_title="METI", page_icon="🧭", layout="wide")
 
@@ -154,49 +239,34 @@ with st.sidebar:
 # ────────────────────────────────────────────────
 # CALCULATIONS
 # ────────────────────────────────────────────────
-all_data = {}
 with st.spinner("Fetching market signals..."):
-    for ticker in ASSETS:
-        d, p = get_all_asset_data(ticker)
-        all_data[ticker] = {"data": d, "price": p}
-
-market_raw = calculate_market_raw(all_data)
-market_norm = normalize_market(market_raw)
-geo_score = calculate_geo_score(carriers, us_military, idf_alert, sentiment)
-final_index = 0.7 * market_norm + 0.3 * geo_score
-
-level_text, level_color = (
-    ("🟢 Low Tension", "#10b981") if final_index < 30 else
-    ("🟡 Moderate Tension", "#facc15") if final_index < 60 else
-    ("🟠 Elevated Tension", "#fb923c") if final_index < 80 else
-    ("🔴 High Tension", "#ef4444")
-)
+    all_data = get_all_market_data()
+
+# Reuse the last result when neither the sidebar inputs nor the fetched changes have moved
+market_key = tuple(tuple(all_data[t]["data"].values()) for t in ASSETS)
+state_key = (carriers, us_military, idf_alert, sentiment, market_key)
+if st.session_state.get("_last_key") == state_key:
+    market_norm, geo, final_index, level_text, level_color = st.session_state["_last_result"]
+else:
+    market_raw = calculate_market_raw(all_data)
+    market_norm = normalize_market(market_raw)
+    geo = calculate_geo_score(carriers, us_military, idf_alert, sentiment)
+    final_index = 0.7 * market_norm + 0.3 * geo.total
+
+    level_text, level_color = (
+        ("🟢 Low Tension", "#10b981") if final_index < 30 else
+        ("🟡 Moderate Tension", "#facc15") if final_index < 60 else
+        ("🟠 Elevated Tension", "#fb923c") if final_index < 80 else
+        ("🔴 High Tension", "#ef4444")
+    )
+    st.session_state["_last_key"] = state_key
+    st.session_state["_last_result"] = (market_norm, geo, final_index, level_text, level_color)
+geo_score = geo.total
 
 # ────────────────────────────────────────────────
 # COOLER GAUGE
 # ────────────────────────────────────────────────
-fig = go.Figure(go.Indicator(
-    mode="gauge+number",
-    value=final_index,
-    title={"text": "Tension Index", "font": {"size": 28, "color": "white"}},
-    number={"font": {"size": 72, "color": "white"}},
-    gauge={
-        "axis": {"range": [0, 100], "tickwidth": 2, "tickcolor": "white"},
-        "bar": {"color": level_color, "thickness": 0.32},
-        "bgcolor": "rgba(0,0,0,0)",
-        "borderwidth": 3,
-        "bordercolor": "rgba(255,255,255,0.5)",
-        "steps": [
-            {"range": [0, 30],  "color": "rgba(16,185,129,0.55)"},
-            {"range": [30, 60], "color": "rgba(250,204,21,0.55)"},
-            {"range": [60, 80], "color": "rgba(249,115,22,0.55)"},
-            {"range": [80, 100],"color": "rgba(239,68,68,0.65)"}
-        ],
-        "threshold": {"line": {"color": "white", "width": 7}, "thickness": 1.0, "value": final_index}
-    }
-))
-
-fig.update_layout(height=400, paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=40, b=40))
+fig = build_gauge(round(final_index, 1), level_color)
 st.plotly_chart(fig, width="stretch")
 
 st.markdown(f"""
@@ -207,44 +277,47 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ────────────────────────────────────────────────
-# MARKET SIGNALS
+# MARKET SIGNALS & TIMEFRAME
 # ────────────────────────────────────────────────
-st.markdown("### 📊 Market Signals")
-cols = st.columns(3)
-tf = st.session_state.get("tf", "1d")
-
-for i, ticker in enumerate(ASSETS):
-    info = ASSETS[ticker]
-    change = all_data[ticker]["data"].get(tf, 0.0) * info["direction"]
-    color = "#10b981" if change >= 0 else "#ef4444"
-    with cols[i % 3]:
-        st.markdown(f"""
-        <div class="asset-card" title="{info['tooltip']}">
-            <div style="font-size:4.5rem;margin-bottom:10px;">{info['emoji']}</div>
-            <div style="color:{info['color']};font-weight:bold;font-size:1.35rem;">{info['name']}</div>
-            <div style="font-size:1.7rem;color:#e2e8f0;margin:10px 0;">${all_data[ticker]['price']:,.2f}</div>
-            <div style="color:{color};font-size:1.6rem;font-weight:bold;">
-                {'▲' if change>=0 else '▼'} {abs(change):.2f}%
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+def set_timeframe(key):
+    st.session_state.tf = key
+
+# Timeframe clicks only rerun this fragment, not the whole script
+@st.fragment
+def market_signals_fragment(all_data):
+    st.markdown("### 📊 Market Signals")
+    cols = st.columns(3)
+    tf = st.session_state.get("tf", "1d")
+
+    for i, (ticker, info) in enumerate(ASSETS.items()):
+        change = all_data[ticker]["data"].get(tf, 0.0)
+        color = "#10b981" if change >= 0 else "#ef4444"
+        arrow = "▲" if change >= 0 else "▼"
+        with cols[i % 3]:
+            st.markdown(ASSET_CARD_TMPL.format(
+                tooltip=info['tooltip'], emoji=info['emoji'], color=info['color'], name=info['name'],
+                price=all_data[ticker]['price'], chg_color=color, arrow=arrow, abs_chg=abs(change)
+            ), unsafe_allow_html=True)
+
+    st.markdown("### ⏱️ Select Timeframe")
+    timeframe_cols = st.columns(4)
+    for i, (key, label) in enumerate([("1h","1 Hour"), ("4h","4 Hours"), ("1d","1 Day"), ("1wk","1 Week")]):
+        with timeframe_cols[i]:
+            # on_click runs before the fragment rerenders, so the cards pick up the new tf
+            st.button(
+                label,
+                key=key,
+                use_container_width=True,
+                type="primary" if tf == key else "secondary",
+                on_click=set_timeframe,
+                args=(key,)
+            )
+
+market_signals_fragment(all_data)
 
 # ────────────────────────────────────────────────
-# TIMEFRAME & DETAILS & BREAKDOWN
+# DETAILS & BREAKDOWN
 # ────────────────────────────────────────────────
-st.markdown("### ⏱️ Select Timeframe")
-timeframe_cols = st.columns(4)
-for i, (key, label) in enumerate([("1h","1 Hour"), ("4h","4 Hours"), ("1d","1 Day"), ("1wk","1 Week")]):
-    with timeframe_cols[i]:
-        if st.button(
-            label,
-            key=key,
-            use_container_width=True,
-            type="primary" if tf == key else "secondary"
-        ):
-            st.session_state.tf = key
-            st.rerun()
-
 st.markdown("### 📊 Details & Breakdown")
 colM, colG = st.columns(2)
 with colM: st.metric("**Market Signals (70%)**", f"{market_norm:.1f}/100")
@@ -254,21 +327,17 @@ st.markdown("#### Geopolitical Contribution")
 gcols = st.columns(4)
 
 for idx, (title, value, score, maxv, color_key) in enumerate([
-    ("US Carriers", f"{carriers}/4", min(carriers,4)*8.75, 35, "#a6a6a6"),
-    ("US Military", us_military, {"Low":0,"Moderate":15,"High":25,"Extreme":32,"Unprecedented":40}.get(us_military,25), 40, "#a6a6a6"),
-    ("IDF Alert", idf_alert, {"Low":0,"Moderate":8,"High":15}.get(idf_alert,8), 15, "#a6a6a6"),
-    ("News/Social", f"{sentiment}/10", sentiment, 10, "#a6a6a6")
+    ("US Carriers", f"{carriers}/4", geo.carrier, 35, "#a6a6a6"),
+    ("US Military", us_military, geo.military, 40, "#a6a6a6"),
+    ("IDF Alert", idf_alert, geo.idf, 15, "#a6a6a6"),
+    ("News/Social", f"{sentiment}/10", geo.sentiment, 10, "#a6a6a6")
 ]):
     score_val = score if isinstance(score, (int,float)) else 0
     color = get_progress_color(score_val, maxv)
     with gcols[idx]:
-        st.markdown(f"""
-        <div class="geo-card" title="Contribution to overall tension index">
-            <div style="font-weight:bold;color:{color_key};font-size:1.25rem;">{title}</div>
-            <div style="font-size:1.6rem;color:white;margin:8px 0;">{value}</div>
-            <div style="color:{color};font-size:1.35rem;font-weight:bold;">+{score_val:.1f}</div>
-            <div style="height:12px;background:{color};border-radius:6px;margin-top:10px;width:{min((score_val/maxv)*100,100)}%"></div>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(GEO_CARD_TMPL.format(
+            title_color=color_key, title=title, value=value, color=color,
+            score=score_val, width=min((score_val/maxv)*100,100)
+        ), unsafe_allow_html=True)
 
 st.caption(f"Last updated: {datetime.now().strftime('%H:%M:%S')}")